@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Update Indexes on Existing Crypto Tables
+
+Base.metadata.create_all() only creates indexes for new tables, so databases created
+before the crypto index changes need this script. It adds the composite trade-history
+index and the price-cache fetched_at index, and drops the crypto_accounts symbol index
+that duplicates uq_crypto_account_user_symbol. Safe to run more than once.
+"""
+
+from sqlalchemy import text
+
+from database import engine
+
+
+STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS ix_crypto_trades_user_symbol_created "
+    "ON crypto_trades (user_id, symbol, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_crypto_price_cache_fetched_at "
+    "ON crypto_price_cache (fetched_at)",
+    "DROP INDEX IF EXISTS ix_crypto_accounts_symbol",
+]
+
+
+def add_crypto_indexes():
+    """Apply the crypto index changes to an existing database."""
+    print("\n" + "="*80)
+    print("Updating Crypto Indexes")
+    print("="*80 + "\n")
+    
+    try:
+        with engine.begin() as conn:
+            for statement in STATEMENTS:
+                conn.execute(text(statement))
+                print(f"✅ {statement}")
+        
+        print("\n✅ Crypto indexes are up to date!")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    add_crypto_indexes()
@@ -1,8 +1,11 @@
+from datetime import datetime
+
+from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRouter
 
-from database import Base, engine
+from database import Base, SessionLocal, engine
 from faceid.router import router as faceid_router
 from predict.router import router as predict_router
 from rag_agent.routes.live_query_router import router as rag_live_query_router
@@ -14,6 +17,12 @@ from services.product.router import router as product_router
 from services.transaction.router import router as transaction_router
 from rag_agent.routes.transaction_router import router as rag_transaction_router
 from services.crypto.router import router as crypto_router
+from services.crypto.service import (
+    PRICE_REFRESH_SECONDS,
+    close_http_client,
+    ensure_assets_seeded,
+    refresh_prices,
+)
 
 
 app = FastAPI(
@@ -30,6 +39,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+scheduler = BackgroundScheduler()
+
 router = APIRouter()
 router.prefix = "/api"
 
@@ -52,4 +63,16 @@ app.include_router(crypto_router)
 
 @app.on_event("startup")
 def startup_event():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        ensure_assets_seeded(db)
+    finally:
+        db.close()
+    scheduler.add_job(refresh_prices, "interval", seconds=PRICE_REFRESH_SECONDS, next_run_time=datetime.now())
+    scheduler.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    scheduler.shutdown(wait=False)
+    close_http_client()
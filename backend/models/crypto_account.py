@@ -12,14 +12,15 @@ class CryptoAccount(Base):
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    symbol = Column(String(10), ForeignKey("crypto_assets.symbol"), nullable=False, index=True)
+    # (user_id, symbol) lookups use uq_crypto_account_user_symbol
+    symbol = Column(String(10), ForeignKey("crypto_assets.symbol"), nullable=False)
     # High precision for balances
     balance = Column(Numeric(28, 10), default=0)
 
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
-    # Relationships
-    user = relationship("User")
+    # Relationships (load explicitly, e.g. selectinload, so hidden N+1 queries fail loudly)
+    user = relationship("User", lazy="raise")
 
 
@@ -1,10 +1,13 @@
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, Numeric
+from sqlalchemy import Column, String, DateTime, Numeric, Index
 from database import Base
 
 
 class CryptoPriceCache(Base):
     __tablename__ = "crypto_price_cache"
+    __table_args__ = (
+        Index("ix_crypto_price_cache_fetched_at", "fetched_at"),
+    )
 
     symbol = Column(String(10), primary_key=True)
     price_kzt = Column(Numeric(18, 2), nullable=False)
@@ -1,10 +1,13 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Numeric
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Numeric, Index
 from database import Base
 
 
 class CryptoTrade(Base):
     __tablename__ = "crypto_trades"
+    __table_args__ = (
+        Index("ix_crypto_trades_user_symbol_created", "user_id", "symbol", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -0,0 +1,39 @@
+from decimal import Decimal
+
+# Internal money math uses scaled ints: KZT in tiyn, crypto quantities in 1e-10 units
+KZT_SCALE = 100
+QTY_SCALE = 10 ** 10
+
+
+def kzt_to_i(d: Decimal) -> int:
+    return int(d * KZT_SCALE)
+
+
+def qty_to_i(d: Decimal) -> int:
+    return int(d * QTY_SCALE)
+
+
+def i_to_kzt(i: int) -> Decimal:
+    return Decimal(i).scaleb(-2)
+
+
+def i_to_qty(i: int) -> Decimal:
+    return Decimal(i).scaleb(-10)
+
+
+def div_round(n: int, d: int) -> int:
+    """Divide non-negative ints rounding half to even, like Decimal.quantize."""
+    q, r = divmod(n, d)
+    if 2 * r > d or (2 * r == d and q % 2):
+        q += 1
+    return q
+
+
+def qty_for_kzt(kzt_amount: Decimal, price: Decimal) -> Decimal:
+    """Crypto quantity a KZT amount buys at price, truncated to 1e-10."""
+    return i_to_qty(kzt_to_i(kzt_amount) * QTY_SCALE // kzt_to_i(price))
+
+
+def kzt_for_qty(quantity: Decimal, price: Decimal) -> Decimal:
+    """KZT value of a crypto quantity at price, rounded half-even to the tiyn."""
+    return i_to_kzt(div_round(qty_to_i(quantity) * kzt_to_i(price), QTY_SCALE))
@@ -1,5 +1,6 @@
 from decimal import Decimal
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 
 from database import get_db
@@ -7,18 +8,22 @@ from .schemas import (
     MarketBuyRequest,
     MarketSellRequest,
     BalancesResponse,
-    BalancesItem,
     PriceResponse,
 )
 from .service import get_user_balances, get_prices_kzt, market_buy, market_sell, SUPPORTED
 
-router = APIRouter(prefix="/api/crypto", tags=["Crypto"])
+router = APIRouter(prefix="/api/crypto", tags=["Crypto"], default_response_class=ORJSONResponse)
+
+
+def _dec(d: Decimal) -> str:
+    # Fixed-point string so values like 0E-10 never reach clients
+    return format(d, "f")
 
 
 @router.get("/prices", response_model=list[PriceResponse])
 def get_prices(db: Session = Depends(get_db)):
-    prices = get_prices_kzt(db, list(SUPPORTED))
-    return [{"symbol": s, "price_kzt": p} for s, p in prices.items()]
+    prices = get_prices_kzt(db, list(SUPPORTED), allow_stale=True)
+    return ORJSONResponse([{"symbol": s, "price_kzt": _dec(p)} for s, p in prices.items()])
 
 
 @router.get("/portfolio/balances", response_model=BalancesResponse)
@@ -26,11 +31,22 @@ def get_balances(user_id: int = Query(..., description="Authenticated user id"),
                  db: Session = Depends(get_db)):
     try:
         items, total = get_user_balances(db, user_id)
-        return BalancesResponse(
-            items=[BalancesItem(**it) for it in items],
-            total_value_kzt=total,
+        return ORJSONResponse(
+            {
+                "items": [
+                    {
+                        "symbol": it["symbol"],
+                        "quantity": _dec(it["quantity"]),
+                        "price_kzt": _dec(it["price_kzt"]),
+                        "value_kzt": _dec(it["value_kzt"]),
+                    }
+                    for it in items
+                ],
+                "total_value_kzt": _dec(total),
+            }
         )
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -43,11 +59,12 @@ def post_market_buy(payload: MarketBuyRequest,
             db,
             user_id=user_id,
             symbol=payload.symbol,
-            kzt_amount=Decimal(str(payload.kzt_amount)),
+            kzt_amount=payload.kzt_amount,
             kzt_account_id=payload.kzt_account_id,
         )
         return res
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -60,11 +77,12 @@ def post_market_sell(payload: MarketSellRequest,
             db,
             user_id=user_id,
             symbol=payload.symbol,
-            quantity=Decimal(str(payload.quantity)),
+            quantity=payload.quantity,
             kzt_account_id=payload.kzt_account_id,
         )
         return res
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -1,37 +1,48 @@
 from decimal import Decimal
-from pydantic import BaseModel, Field, condecimal, constr
-from typing import List
+from pydantic import BaseModel, ConfigDict, Field, condecimal, field_validator
+from typing import List, Literal
 
 
-SupportedSymbol = constr(to_upper=True, strip_whitespace=True, pattern="^(BTC|ETH|USDT)$")
+SupportedSymbol = Literal["BTC", "ETH", "USDT"]
 
 
-class PriceResponse(BaseModel):
+class _CryptoSchema(BaseModel):
+    model_config = ConfigDict(validate_assignment=False, str_strip_whitespace=True)
+
+
+class _SymbolRequest(_CryptoSchema):
+    @field_validator("symbol", mode="before", check_fields=False)
+    @classmethod
+    def normalize_symbol(cls, v):
+        if isinstance(v, str):
+            return v.strip().upper()
+        return v
+
+
+class PriceResponse(_CryptoSchema):
     symbol: SupportedSymbol
     price_kzt: condecimal(max_digits=18, decimal_places=2)
 
 
-class BalancesItem(BaseModel):
+class BalancesItem(_CryptoSchema):
     symbol: SupportedSymbol
     quantity: condecimal(max_digits=28, decimal_places=10) = Decimal("0")
     price_kzt: condecimal(max_digits=18, decimal_places=2)
     value_kzt: condecimal(max_digits=18, decimal_places=2)
 
 
-class BalancesResponse(BaseModel):
+class BalancesResponse(_CryptoSchema):
     items: List[BalancesItem]
     total_value_kzt: condecimal(max_digits=18, decimal_places=2)
 
 
-class MarketBuyRequest(BaseModel):
+class MarketBuyRequest(_SymbolRequest):
     symbol: SupportedSymbol = Field(description="BTC, ETH or USDT")
     kzt_amount: condecimal(gt=0, max_digits=18, decimal_places=2)
     kzt_account_id: int = Field(description="Destination wallet account (KZT) to debit during buy")
 
 
-class MarketSellRequest(BaseModel):
+class MarketSellRequest(_SymbolRequest):
     symbol: SupportedSymbol
     quantity: condecimal(gt=0, max_digits=28, decimal_places=10)
     kzt_account_id: int = Field(description="Destination wallet account (KZT) to credit during sell")
-
-
@@ -1,30 +1,144 @@
+import logging
+import os
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_DOWN
-from typing import Dict, List, Tuple
+from decimal import Decimal
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
+import redis
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
+from urllib3.util.retry import Retry
 
-from database import get_db
+from database import SessionLocal
 from models import CryptoAccount, CryptoAsset, CryptoPriceCache, CryptoTrade, Account
+from services.crypto.money import (
+    QTY_SCALE,
+    div_round,
+    i_to_kzt,
+    i_to_qty,
+    kzt_for_qty,
+    kzt_to_i,
+    qty_for_kzt,
+    qty_to_i,
+)
 from services.transaction.service import create_deposit, create_withdrawal
 from services.transaction.schemas import TransactionDeposit, TransactionWithdrawal
 
+logger = logging.getLogger(__name__)
+
 SUPPORTED = ("BTC", "ETH", "USDT")
 COINGECKO_IDS = {"BTC": "bitcoin", "ETH": "ethereum", "USDT": "tether"}
+NAMES = {"BTC": "Bitcoin", "ETH": "Ethereum", "USDT": "Tether"}
+
+_ASSETS_SEEDED = False
+
+PRICE_TTL_SECONDS = 30
+# Background refresh runs inside the TTL so requests keep finding fresh prices
+PRICE_REFRESH_SECONDS = 20
+
+Q_KZT = Decimal("0.01")
+ZERO = Decimal(0)
+
+# Hot-path statements built once; executions reuse the engine's compiled SQL cache
+_SEL_PRICE_CACHE = select(CryptoPriceCache).where(
+    CryptoPriceCache.symbol.in_(bindparam("symbols", expanding=True))
+)
+_SEL_BALANCES = select(CryptoAccount.symbol, CryptoAccount.balance).where(
+    CryptoAccount.user_id == bindparam("u"), CryptoAccount.symbol.in_(SUPPORTED)
+)
+_SEL_WALLET_FOR_UPDATE = select(Account).where(Account.id == bindparam("a")).with_for_update()
+_DEBIT_CRYPTO = (
+    update(CryptoAccount)
+    .where(
+        CryptoAccount.user_id == bindparam("u"),
+        CryptoAccount.symbol == bindparam("s"),
+        CryptoAccount.balance >= bindparam("qty"),
+    )
+    .values(balance=CryptoAccount.balance - bindparam("qty"))
+    .execution_options(synchronize_session=False)
+)
+_INS_TRADE = insert(CryptoTrade).returning(CryptoTrade.id)
+
+# Fetch time budget. One retry at (1s connect, 3s read) plus backoff keeps a single CoinGecko
+# call near 8s, under _FETCH_SECONDS. 429 is not retried and Retry-After is ignored, so rate
+# limits fail fast; the next scheduled refresh tries again.
+_HTTP_TIMEOUT = (1, 3)
+_FETCH_SECONDS = 9
+# The Redis lock outlives its holder's fetch; other workers wait at most that long for it
+_REDIS_LOCK_SECONDS = _FETCH_SECONDS
+_REDIS_WAIT_SECONDS = _REDIS_LOCK_SECONDS
+# An in-process leader may wait on Redis and then fetch; its waiters must outlast both
+_FETCH_WAIT_SECONDS = _REDIS_WAIT_SECONDS + _FETCH_SECONDS + 2
+
+# Shared session so CoinGecko calls reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=10,
+        max_retries=Retry(
+            total=1,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            respect_retry_after_header=False,
+        ),
+    ),
+)
+
+# Optional Redis cache shared by all workers; values are "<price>|<unix fetch time>"
+REDIS_URL = os.getenv("REDIS_URL")
+_REDIS = (
+    redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=0.2, socket_connect_timeout=0.2)
+    if REDIS_URL
+    else None
+)
+# Delete the fetch lock only if it still holds our token, so an overrun holder can't free another's
+_RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+# Process-local price cache in front of CryptoPriceCache: symbol -> (price, monotonic fetch time)
+_PRICE_MEM: Dict[str, Tuple[Decimal, float]] = {}
+_LOCK = threading.Lock()
+
+
+class _Flight:
+    """An in-progress price fetch that concurrent callers wait on instead of fetching."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Decimal]] = None
+        self.error: Optional[Exception] = None
+        # Set once a waiter has taken the single solo fetch allowed after a wait timeout
+        self.solo_claimed = False
+
+
+# Single-flight registry so concurrent misses share one CoinGecko request
+_IN_FLIGHT: Dict[FrozenSet[str], _Flight] = {}
 
 
 def ensure_assets_seeded(db: Session) -> None:
-    for sym, name in [("BTC", "Bitcoin"), ("ETH", "Ethereum"), ("USDT", "Tether")]:
-        if not db.query(CryptoAsset).filter(CryptoAsset.symbol == sym).first():
-            db.add(CryptoAsset(symbol=sym, name=name))
-    db.commit()
+    global _ASSETS_SEEDED
+    if _ASSETS_SEEDED:
+        return
+
+    existing = {r[0] for r in db.query(CryptoAsset.symbol).filter(CryptoAsset.symbol.in_(SUPPORTED)).all()}
+    missing = [s for s in SUPPORTED if s not in existing]
+    if missing:
+        db.bulk_save_objects([CryptoAsset(symbol=s, name=NAMES[s]) for s in missing])
+        db.commit()
+    _ASSETS_SEEDED = True
 
 
 def _fetch_price_from_coingecko(symbols: List[str]) -> Dict[str, Decimal]:
     ids = ",".join(COINGECKO_IDS[s] for s in symbols)
     url = f"https://api.coingecko.com/api/v3/simple/price?ids={ids}&vs_currencies=kzt"
-    res = requests.get(url, timeout=10)
+    res = _SESSION.get(url, timeout=_HTTP_TIMEOUT)
     res.raise_for_status()
     data = res.json()
     out: Dict[str, Decimal] = {}
@@ -32,122 +146,358 @@ def _fetch_price_from_coingecko(symbols: List[str]) -> Dict[str, Decimal]:
         price = data.get(COINGECKO_IDS[s], {}).get("kzt")
         if price is None:
             raise ValueError(f"Price for {s} not available")
-        out[s] = Decimal(str(price)).quantize(Decimal("0.01"))
+        out[s] = Decimal(str(price)).quantize(Q_KZT)
     return out
 
 
-def get_prices_kzt(db: Session, symbols: List[str], ttl_seconds: int = 30) -> Dict[str, Decimal]:
-    now = datetime.utcnow()
+def close_http_client() -> None:
+    _SESSION.close()
+
+
+def _remember_prices(prices: Dict[str, Decimal], fetched_at: float) -> None:
+    with _LOCK:
+        for s, price in prices.items():
+            _PRICE_MEM[s] = (price, fetched_at)
+
+
+def _read_redis_prices(symbols: List[str], ttl_seconds: int) -> Dict[str, Tuple[Decimal, float]]:
+    """Return symbol -> (price, age in seconds) for fresh Redis entries."""
+    if _REDIS is None:
+        return {}
+    try:
+        values = _REDIS.mget([f"px:{s}" for s in symbols])
+    except redis.RedisError:
+        return {}
+
+    now = time.time()
+    out: Dict[str, Tuple[Decimal, float]] = {}
+    for s, value in zip(symbols, values):
+        if not value:
+            continue
+        price, fetched_at = value.split("|")
+        age = now - float(fetched_at)
+        if age < ttl_seconds:
+            out[s] = (Decimal(price), age)
+    return out
+
+
+def _write_redis_prices(prices: Dict[str, Decimal]) -> None:
+    # Shared entries always live for the standard TTL; callers' ttl_seconds only affects reads
+    if _REDIS is None:
+        return
+    now = time.time()
+    try:
+        pipe = _REDIS.pipeline(transaction=False)
+        for s, price in prices.items():
+            pipe.set(f"px:{s}", f"{price}|{now}", ex=PRICE_TTL_SECONDS)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def _fetch_and_share(symbols: List[str]) -> Dict[str, Decimal]:
+    fetched = _fetch_price_from_coingecko(symbols)
+    _remember_prices(fetched, time.monotonic())
+    _write_redis_prices(fetched)
+    return fetched
+
+
+def _wait_for_lock_holder(symbols: List[str], ttl_seconds: int, lock_key: str,
+                          deadline: float) -> Optional[Dict[str, Decimal]]:
+    """Poll until the worker holding lock_key publishes prices.
+
+    Returns None once the lock is released without fresh prices, so the caller can retry
+    SET NX; raises if the holder reports a failure or the deadline passes.
+    """
+    holder = _REDIS.get(lock_key)
+    while holder is not None:
+        if time.monotonic() >= deadline:
+            raise TimeoutError("Timed out waiting for another worker's crypto price fetch")
+        time.sleep(0.1)
+        # Read the lock state before prices: the holder publishes prices before releasing
+        pipe = _REDIS.pipeline(transaction=False)
+        pipe.get(lock_key)
+        pipe.exists(f"px:fail:{holder}")
+        current, failed = pipe.execute()
+
+        shared = _read_redis_prices(symbols, ttl_seconds)
+        if len(shared) == len(symbols):
+            mono_now = time.monotonic()
+            for s, (price, age) in shared.items():
+                _remember_prices({s: price}, mono_now - age)
+            return {s: price for s, (price, _) in shared.items()}
+        if failed:
+            raise RuntimeError("Crypto price fetch failed in another worker")
+        if current != holder:
+            return None
+    return None
+
+
+def _fetch_across_workers(symbols: List[str], ttl_seconds: int) -> Tuple[Dict[str, Decimal], bool]:
+    """Fetch prices, letting only one worker call CoinGecko when Redis is configured."""
+    if _REDIS is None:
+        return _fetch_and_share(symbols), True
+
+    lock_key = "px:lock:" + ",".join(sorted(symbols))
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + _REDIS_WAIT_SECONDS
+    try:
+        while not _REDIS.set(lock_key, token, nx=True, ex=_REDIS_LOCK_SECONDS):
+            # Another worker is fetching; wait for its result to land in Redis
+            shared = _wait_for_lock_holder(symbols, ttl_seconds, lock_key, deadline)
+            if shared is not None:
+                return shared, False
+    except redis.RedisError:
+        # Redis unavailable: fetch without cross-worker coordination
+        return _fetch_and_share(symbols), True
+
+    try:
+        return _fetch_and_share(symbols), True
+    except Exception:
+        # Tell waiting workers this attempt failed so they stop polling
+        try:
+            _REDIS.set(f"px:fail:{token}", "1", ex=_REDIS_LOCK_SECONDS)
+        except redis.RedisError:
+            pass
+        raise
+    finally:
+        try:
+            _REDIS.eval(_RELEASE_LOCK, 1, lock_key, token)
+        except redis.RedisError:
+            pass
+
+
+def _fetch_prices_single_flight(symbols: List[str], ttl_seconds: int) -> Tuple[Dict[str, Decimal], bool]:
+    """Fetch prices, coalescing concurrent callers; returns (prices, fetched_by_this_caller)."""
+    key = frozenset(symbols)
+    with _LOCK:
+        flight = _IN_FLIGHT.get(key)
+        leader = flight is None
+        if leader:
+            flight = _IN_FLIGHT[key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(timeout=_FETCH_WAIT_SECONDS):
+            if flight.error is not None:
+                # Share the leader's failure rather than stampeding CoinGecko ourselves
+                raise RuntimeError(f"Crypto price fetch failed: {flight.error}") from flight.error
+            return flight.result, False
+
+        # The leader is stuck; let exactly one waiter try on its own
+        with _LOCK:
+            solo = not flight.solo_claimed
+            flight.solo_claimed = True
+        if not solo:
+            raise TimeoutError("Timed out waiting for crypto price fetch")
+        fetched = _fetch_price_from_coingecko(symbols)
+        _remember_prices(fetched, time.monotonic())
+        return fetched, True
+
+    try:
+        fetched, fetched_here = _fetch_across_workers(symbols, ttl_seconds)
+        flight.result = fetched
+        return fetched, fetched_here
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _LOCK:
+            _IN_FLIGHT.pop(key, None)
+        flight.done.set()
+
+
+def _store_price_cache(db: Session, prices: Dict[str, Decimal], fetched_at: datetime) -> None:
+    stmt = pg_insert(CryptoPriceCache).values(
+        [{"symbol": s, "price_kzt": price, "fetched_at": fetched_at} for s, price in prices.items()]
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[CryptoPriceCache.symbol],
+            set_={"price_kzt": stmt.excluded.price_kzt, "fetched_at": stmt.excluded.fetched_at},
+        )
+    )
+    db.commit()
+
+
+def refresh_prices() -> None:
+    """Scheduled job: refresh every supported price in memory, Redis and CryptoPriceCache."""
+    # Another worker refreshed recently enough that its prices outlive our next tick
+    shared = _read_redis_prices(list(SUPPORTED), PRICE_TTL_SECONDS - PRICE_REFRESH_SECONDS)
+    if len(shared) == len(SUPPORTED):
+        mono_now = time.monotonic()
+        for s, (price, age) in shared.items():
+            _remember_prices({s: price}, mono_now - age)
+        return
+
+    db = SessionLocal()
+    try:
+        fetched, fetched_here = _fetch_prices_single_flight(list(SUPPORTED), PRICE_TTL_SECONDS)
+        if fetched_here:
+            _store_price_cache(db, fetched, datetime.utcnow())
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Crypto price refresh failed: {e}")
+    finally:
+        db.close()
+
+
+def get_prices_kzt(db: Session, symbols: List[str], ttl_seconds: int = PRICE_TTL_SECONDS,
+                   allow_stale: bool = False) -> Dict[str, Decimal]:
+    """Return KZT prices; allow_stale serves last known prices if CoinGecko is down (never for trades)."""
+    mono_now = time.monotonic()
     fresh: Dict[str, Decimal] = {}
-    missing: List[str] = []
+    pending: List[str] = []
 
     for s in symbols:
-        rec = db.query(CryptoPriceCache).filter(CryptoPriceCache.symbol == s).first()
+        entry = _PRICE_MEM.get(s)
+        if entry and mono_now - entry[1] < ttl_seconds:
+            fresh[s] = entry[0]
+        else:
+            pending.append(s)
+
+    if not pending:
+        return fresh
+
+    # Redis answers for every worker; only fall through to the DB for what it lacks
+    for s, (price, age) in _read_redis_prices(pending, ttl_seconds).items():
+        _remember_prices({s: price}, mono_now - age)
+        fresh[s] = price
+    pending = [s for s in pending if s not in fresh]
+    if not pending:
+        return fresh
+
+    now = datetime.utcnow()
+    missing: List[str] = []
+    cached = db.execute(_SEL_PRICE_CACHE, {"symbols": pending}).scalars().all()
+    by_symbol = {rec.symbol: rec for rec in cached}
+
+    for s in pending:
+        rec = by_symbol.get(s)
         if rec and (now - rec.fetched_at) <= timedelta(seconds=ttl_seconds):
-            fresh[s] = Decimal(rec.price_kzt).quantize(Decimal("0.01"))
+            price = Decimal(rec.price_kzt).quantize(Q_KZT)
+            # Keep the original fetch time so the entry expires with the DB row
+            _remember_prices({s: price}, mono_now - (now - rec.fetched_at).total_seconds())
+            fresh[s] = price
         else:
             missing.append(s)
 
     if missing:
-        fetched = _fetch_price_from_coingecko(missing)
-        for s, price in fetched.items():
-            rec = db.query(CryptoPriceCache).filter(CryptoPriceCache.symbol == s).first()
-            if rec:
-                rec.price_kzt = price
-                rec.fetched_at = now
-            else:
-                db.add(CryptoPriceCache(symbol=s, price_kzt=price, fetched_at=now))
-        db.commit()
-        fresh.update(fetched)
+        # Normally refresh_prices keeps the caches warm; as a fallback, fetch inline.
+        # One CoinGecko call covers every supported symbol, so refresh them all together.
+        try:
+            fetched, fetched_here = _fetch_prices_single_flight(list(SUPPORTED), ttl_seconds)
+        except Exception:
+            if not allow_stale:
+                raise
+            stale = {s: Decimal(by_symbol[s].price_kzt).quantize(Q_KZT) for s in missing if s in by_symbol}
+            if len(stale) < len(missing):
+                raise
+            # Upstream unavailable: serve the last known good prices
+            logger.warning(f"Serving last known prices for {', '.join(missing)}")
+            fresh.update(stale)
+            return fresh
+
+        fresh.update((s, fetched[s]) for s in missing)
+        if fetched_here:
+            _store_price_cache(db, fetched, now)
 
     return fresh
 
 
 def get_user_balances(db: Session, user_id: int) -> Tuple[List[Dict], Decimal]:
-    ensure_assets_seeded(db)
-    accounts = db.query(CryptoAccount).filter(CryptoAccount.user_id == user_id).all()
-    by_symbol = {a.symbol: a for a in accounts}
+    balances = dict(db.execute(_SEL_BALANCES, {"u": user_id}).all())
 
     # Guarantee rows for supported symbols
-    for sym in SUPPORTED:
-        if sym not in by_symbol:
-            acct = CryptoAccount(user_id=user_id, symbol=sym, balance=Decimal("0"))
-            db.add(acct)
-            by_symbol[sym] = acct
-    db.commit()
+    missing = [s for s in SUPPORTED if s not in balances]
+    if missing:
+        db.execute(
+            pg_insert(CryptoAccount)
+            .values([{"user_id": user_id, "symbol": s, "balance": ZERO} for s in missing])
+            .on_conflict_do_nothing()
+        )
+        db.commit()
 
-    prices = get_prices_kzt(db, list(SUPPORTED))
+    prices = get_prices_kzt(db, list(SUPPORTED), allow_stale=True)
     items: List[Dict] = []
-    total = Decimal("0.00")
+    total_i = 0
 
+    # Python ints on purpose: qty_i * price_i for one BTC already exceeds int64
     for sym in SUPPORTED:
-        qty = Decimal(by_symbol[sym].balance or 0).quantize(Decimal("0.0000000001"))
+        qty_i = qty_to_i(balances.get(sym) or 0)
         price = prices[sym]
-        value = (qty * price).quantize(Decimal("0.01"))
+        value_i = div_round(qty_i * kzt_to_i(price), QTY_SCALE)
         items.append(
             {
                 "symbol": sym,
-                "quantity": qty,
+                "quantity": i_to_qty(qty_i),
                 "price_kzt": price,
-                "value_kzt": value,
+                "value_kzt": i_to_kzt(value_i),
             }
         )
-        total += value
+        total_i += value_i
 
-    return items, total.quantize(Decimal("0.01"))
+    return items, i_to_kzt(total_i)
 
 
 def _get_kzt_wallet(db: Session, user_id: int, kzt_account_id: int) -> Account:
-    wallet = db.query(Account).filter(Account.id == kzt_account_id).first()
+    wallet = db.execute(_SEL_WALLET_FOR_UPDATE, {"a": kzt_account_id}).scalar_one_or_none()
     if not wallet or wallet.user_id != user_id or wallet.currency != "KZT" or wallet.status != "active":
         raise ValueError("Invalid KZT wallet account")
     return wallet
 
 
+def _insert_trade(db: Session, user_id: int, symbol: str, side: str, quantity: Decimal,
+                  price: Decimal, notional: Decimal) -> int:
+    return db.execute(
+        _INS_TRADE,
+        {
+            "user_id": user_id,
+            "symbol": symbol,
+            "side": side,
+            "quantity": quantity,
+            "price_kzt": price,
+            "notional_kzt": notional,
+        },
+    ).scalar_one()
+
+
 def market_buy(db: Session, user_id: int, symbol: str, kzt_amount: Decimal, kzt_account_id: int) -> Dict:
     if symbol not in SUPPORTED:
         raise ValueError("Unsupported symbol")
     if kzt_amount <= 0:
         raise ValueError("Amount must be positive")
 
-    ensure_assets_seeded(db)
-
-    # Validate KZT wallet
-    _get_kzt_wallet(db, user_id, kzt_account_id)
-
-    price = get_prices_kzt(db, [symbol])[symbol]
-    qty = (kzt_amount / price).quantize(Decimal("0.0000000001"), rounding=ROUND_DOWN)
+    price = get_prices_kzt(db, list(SUPPORTED))[symbol]
+    qty = qty_for_kzt(kzt_amount, price)
 
-    # Withdraw KZT from wallet
-    withdrawal = TransactionWithdrawal(
-        account_id=kzt_account_id,
-        amount=kzt_amount,
-        currency="KZT",
-        description=f"BUY {symbol} (market)",
-    )
-    create_withdrawal(withdrawal, user_id, db)
+    # Wallet and crypto rows stay locked until the single commit below
+    try:
+        _get_kzt_wallet(db, user_id, kzt_account_id)
 
-    # Credit crypto balance
-    acct = db.query(CryptoAccount).filter(CryptoAccount.user_id == user_id, CryptoAccount.symbol == symbol).first()
-    if not acct:
-        acct = CryptoAccount(user_id=user_id, symbol=symbol, balance=Decimal("0"))
-        db.add(acct)
-        db.commit()
-        db.refresh(acct)
-    acct.balance = Decimal(acct.balance or 0) + qty
-    db.add(
-        CryptoTrade(
-            user_id=user_id,
-            symbol=symbol,
-            side="buy",
-            quantity=qty,
-            price_kzt=price,
-            notional_kzt=kzt_amount,
+        # Withdraw KZT from wallet
+        withdrawal = TransactionWithdrawal(
+            account_id=kzt_account_id,
+            amount=kzt_amount,
+            currency="KZT",
+            description=f"BUY {symbol} (market)",
         )
-    )
-    db.commit()
+        create_withdrawal(withdrawal, user_id, db, commit=False)
+
+        # Credit crypto balance, creating the account row on first buy
+        credit = pg_insert(CryptoAccount).values(user_id=user_id, symbol=symbol, balance=qty)
+        db.execute(
+            credit.on_conflict_do_update(
+                index_elements=[CryptoAccount.user_id, CryptoAccount.symbol],
+                set_={"balance": CryptoAccount.balance + credit.excluded.balance, "updated_at": datetime.now()},
+            )
+        )
+        trade_id = _insert_trade(db, user_id, symbol, "buy", qty, price, kzt_amount)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
-    return {"symbol": symbol, "quantity": qty, "price_kzt": price, "notional_kzt": kzt_amount}
+    return {"trade_id": trade_id, "symbol": symbol, "quantity": qty, "price_kzt": price, "notional_kzt": kzt_amount}
 
 
 def market_sell(db: Session, user_id: int, symbol: str, quantity: Decimal, kzt_account_id: int) -> Dict:
@@ -156,42 +506,31 @@ def market_sell(db: Session, user_id: int, symbol: str, quantity: Decimal, kzt_a
     if quantity <= 0:
         raise ValueError("Quantity must be positive")
 
-    ensure_assets_seeded(db)
-
-    # Validate KZT wallet
-    _get_kzt_wallet(db, user_id, kzt_account_id)
+    price = get_prices_kzt(db, list(SUPPORTED))[symbol]
+    proceeds = kzt_for_qty(quantity, price)
 
-    acct = db.query(CryptoAccount).filter(CryptoAccount.user_id == user_id, CryptoAccount.symbol == symbol).first()
-    if not acct or Decimal(acct.balance or 0) < quantity:
-        raise ValueError("Insufficient crypto balance")
+    # Wallet and crypto rows stay locked until the single commit below
+    try:
+        _get_kzt_wallet(db, user_id, kzt_account_id)
 
-    price = get_prices_kzt(db, [symbol])[symbol]
-    proceeds = (quantity * price).quantize(Decimal("0.01"))
+        # Debit crypto balance; the guard makes the check and write one statement
+        debited = db.execute(_DEBIT_CRYPTO, {"u": user_id, "s": symbol, "qty": quantity})
+        if debited.rowcount == 0:
+            raise ValueError("Insufficient crypto balance")
 
-    # Debit crypto balance
-    acct.balance = Decimal(acct.balance) - quantity
-
-    # Deposit KZT to wallet
-    deposit = TransactionDeposit(
-        account_id=kzt_account_id,
-        amount=proceeds,
-        currency="KZT",
-        description=f"SELL {symbol} (market)",
-    )
-    create_deposit(deposit, user_id, db)
-
-    db.add(
-        CryptoTrade(
-            user_id=user_id,
-            symbol=symbol,
-            side="sell",
-            quantity=quantity,
-            price_kzt=price,
-            notional_kzt=proceeds,
+        # Deposit KZT to wallet
+        deposit = TransactionDeposit(
+            account_id=kzt_account_id,
+            amount=proceeds,
+            currency="KZT",
+            description=f"SELL {symbol} (market)",
         )
-    )
-    db.commit()
-
-    return {"symbol": symbol, "quantity": quantity, "price_kzt": price, "notional_kzt": proceeds}
+        create_deposit(deposit, user_id, db, commit=False)
 
+        trade_id = _insert_trade(db, user_id, symbol, "sell", quantity, price, proceeds)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
+    return {"trade_id": trade_id, "symbol": symbol, "quantity": quantity, "price_kzt": price, "notional_kzt": proceeds}
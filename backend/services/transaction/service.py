@@ -113,7 +113,8 @@ def verify_product_exists_and_active(product_id: int, db: Session) -> Product:
 def create_deposit(
     deposit_data: TransactionDeposit,
     user_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    commit: bool = True
 ) -> TransactionRead:
     """
     Create a deposit transaction
@@ -122,6 +123,8 @@ def create_deposit(
         deposit_data: Deposit transaction data
         user_id: User ID performing the deposit
         db: Database session
+        commit: Whether to commit; when False changes are only flushed so the
+            caller can complete its own transaction
         
     Returns:
         Created transaction data
@@ -158,7 +161,10 @@ def create_deposit(
     )
     
     db.add(new_transaction)
-    db.commit()
+    if commit:
+        db.commit()
+    else:
+        db.flush()
     db.refresh(new_transaction)
     
     return TransactionRead.from_orm(new_transaction)
@@ -167,7 +173,8 @@ def create_deposit(
 def create_withdrawal(
     withdrawal_data: TransactionWithdrawal,
     user_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    commit: bool = True
 ) -> TransactionRead:
     """
     Create a withdrawal transaction
@@ -176,6 +183,8 @@ def create_withdrawal(
         withdrawal_data: Withdrawal transaction data
         user_id: User ID performing the withdrawal
         db: Database session
+        commit: Whether to commit; when False changes are only flushed so the
+            caller can complete its own transaction
         
     Returns:
         Created transaction data
@@ -219,7 +228,10 @@ def create_withdrawal(
     )
     
     db.add(new_transaction)
-    db.commit()
+    if commit:
+        db.commit()
+    else:
+        db.flush()
     db.refresh(new_transaction)
     
     return TransactionRead.from_orm(new_transaction)
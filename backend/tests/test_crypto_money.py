@@ -0,0 +1,42 @@
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_EVEN
+
+from services.crypto.money import QTY_SCALE, div_round, kzt_for_qty, qty_for_kzt
+
+
+def test_div_round_matches_half_even_quantize_on_ties():
+    # n / d lands exactly on .5: even quotients stay, odd quotients round up
+    for q in range(0, 12):
+        n = (2 * q + 1) * QTY_SCALE // 2
+        expected = (Decimal(n) / Decimal(QTY_SCALE)).quantize(Decimal(1), rounding=ROUND_HALF_EVEN)
+        assert div_round(n, QTY_SCALE) == int(expected)
+        assert div_round(n, QTY_SCALE) == (q if q % 2 == 0 else q + 1)
+
+
+def test_div_round_off_ties():
+    assert div_round(249, 100) == 2
+    assert div_round(251, 100) == 3
+    assert div_round(0, 100) == 0
+
+
+def test_kzt_for_qty_matches_old_quantize():
+    cases = [
+        (Decimal("0.0000000050"), Decimal("1.00")),  # 0.000000005 KZT -> tie at 0.00
+        (Decimal("0.0050000000"), Decimal("1.00")),  # 0.005 -> 0.00 (even)
+        (Decimal("0.0150000000"), Decimal("1.00")),  # 0.015 -> 0.02 (odd rounds up)
+        (Decimal("0.0123456789"), Decimal("45678901.23")),
+        (Decimal("1.5000000000"), Decimal("512.33")),
+    ]
+    for quantity, price in cases:
+        assert kzt_for_qty(quantity, price) == (quantity * price).quantize(Decimal("0.01"))
+
+
+def test_qty_for_kzt_matches_old_round_down():
+    cases = [
+        (Decimal("100.00"), Decimal("3.00")),
+        (Decimal("1.00"), Decimal("45678901.23")),
+        (Decimal("5000.00"), Decimal("512.33")),
+        (Decimal("999999.99"), Decimal("1.01")),
+    ]
+    for kzt_amount, price in cases:
+        expected = (kzt_amount / price).quantize(Decimal("0.0000000001"), rounding=ROUND_DOWN)
+        assert qty_for_kzt(kzt_amount, price) == expected
@@ -0,0 +1,68 @@
+import uuid
+from decimal import Decimal
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from models import Account, User
+from services.crypto.service import ensure_assets_seeded, get_prices_kzt, market_buy, SUPPORTED
+
+# wallet lock, withdrawal (account lookup, balance update, transaction insert, refresh),
+# crypto balance upsert, trade insert
+EXPECTED_STATEMENTS = 7
+MAX_STATEMENTS = EXPECTED_STATEMENTS + 2
+
+
+def test_market_buy_statement_count():
+    # Shared seed/cache data that the app creates at startup anyway
+    setup_db: Session = SessionLocal()
+    try:
+        ensure_assets_seeded(setup_db)
+        # Warm the price cache so only the trade itself is measured
+        get_prices_kzt(setup_db, list(SUPPORTED))
+    finally:
+        setup_db.close()
+
+    # Everything below runs inside an outer transaction that is rolled back;
+    # commits inside market_buy only release savepoints
+    connection = engine.connect()
+    outer = connection.begin()
+    db = Session(bind=connection, join_transaction_mode="create_savepoint")
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            statements.append(statement)
+
+    try:
+        suffix = uuid.uuid4().hex[:10]
+        user = User(
+            name="Query",
+            surname="Counter",
+            email=f"qc-{suffix}@example.com",
+            phone=f"+7{suffix}",
+            password_hash="x",
+        )
+        db.add(user)
+        db.commit()
+        wallet = Account(user_id=user.id, account_type="checking", balance=Decimal("1000.00"), currency="KZT")
+        db.add(wallet)
+        db.commit()
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            market_buy(db, user_id=user.id, symbol="USDT", kzt_amount=Decimal("100.00"), kzt_account_id=wallet.id)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+    finally:
+        db.close()
+        outer.rollback()
+        connection.close()
+
+    assert len(statements) <= MAX_STATEMENTS, (
+        f"market_buy emitted {len(statements)} statements, expected about {EXPECTED_STATEMENTS}: "
+        "wallet SELECT FOR UPDATE, withdrawal account SELECT, account UPDATE, transaction INSERT, "
+        "transaction refresh SELECT, crypto balance upsert, trade INSERT\n" + "\n".join(statements)
+    )